@@ -3,25 +3,118 @@ UQTool 多市场策略 - 支持股票、期货、外汇、期权
 仓位范围：-1~1（负数为空头，正数为多头）
 """
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atexit
+import hashlib
 import json
+import os
+import queue
+import random
+import threading
 import time
 import schedule
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple, Any
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple, Any
 from enum import Enum
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('multi_market_trading.log'),
-        logging.StreamHandler()
-    ]
-)
+# 配置日志：记录先放入队列，由后台线程写文件和终端，定时任务不等待日志I/O
+_log_queue = queue.Queue(-1)
+_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.FileHandler('multi_market_trading.log', delay=True),
+    logging.StreamHandler()
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# 队列端只合并消息参数，时间和级别由输出端格式化
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+_log_listener.start()
+# 退出时停止监听线程，写完队列中剩余的日志
+atexit.register(_log_listener.stop)
+del _handler
 logger = logging.getLogger(__name__)
 
+try:
+    import orjson  # 可选依赖：更快的JSON编解码
+except ImportError:
+    orjson = None
+
+# 历史数据磁盘缓存文件，进程重启后同一交易日无需重新请求；设置环境变量 UQTOOL_FRESH=1 可跳过
+HISTORY_CACHE_FILE = 'history_cache.json'
+
+# 接口健康检查结果缓存，有效期内重启跳过启动时的接口测试；任一接口调用失败时删除
+HEALTH_CACHE_FILE = os.path.expanduser('~/.uqtool_health.json')
+HEALTH_CACHE_TTL = 900
+
+# 持仓记录文件，每次调整后原子写入，重启时加载以避免重复调整；UQTOOL_FRESH=1 时同样跳过
+POSITIONS_FILE = 'positions.json'
+
+# POST请求体为预先序列化的JSON字节
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+def _dumps(obj) -> bytes:
+    """序列化请求体为UTF-8字节，优先使用orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(content: bytes):
+    """解析响应体，优先使用orjson"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _sign(x: float) -> int:
+    """符号函数：正数1，负数-1，零0"""
+    return (x > 0) - (x < 0)
+
+
+# 按weekday()索引的回退天数：周六回退1天、周日回退2天到周五
+_WEEKEND_ROLLBACK = (0, 0, 0, 0, 0, 1, 2)
+
+# 仓位方向名称，按符号索引
+_DIRECTION = {1: "多头", -1: "空头", 0: "空仓"}
+
+
+def _direction(x: float) -> str:
+    """仓位方向名称：多头/空头/空仓"""
+    return _DIRECTION[(x > 0) - (x < 0)]
+
+
+def _direction_pct(x: float) -> str:
+    """仓位方向和比例，如 多头80.0%"""
+    return f"{_DIRECTION[(x > 0) - (x < 0)]}{abs(x) * 100:.1f}%"
+
+
+# 仓位调整动作表：(旧仓位方向, 新仓位方向, |新仓位|与|旧仓位|比较) -> 动作
+_ACTION_TABLE: Dict[Tuple[int, int, int], str] = {}
+for _cmp in (-1, 0, 1):
+    # 建仓、平仓、反手只取决于新旧方向
+    _ACTION_TABLE[(0, 1, _cmp)] = "建多仓"
+    _ACTION_TABLE[(0, -1, _cmp)] = "建空仓"
+    _ACTION_TABLE[(0, 0, _cmp)] = "保持不变"
+    _ACTION_TABLE[(1, 0, _cmp)] = "平多仓"
+    _ACTION_TABLE[(1, -1, _cmp)] = "多转空"
+    _ACTION_TABLE[(-1, 0, _cmp)] = "平空仓"
+    _ACTION_TABLE[(-1, 1, _cmp)] = "空转多"
+# 同向时按仓位大小判断增减
+_ACTION_TABLE.update({
+    (1, 1, 1): "增多仓", (1, 1, -1): "减多仓", (1, 1, 0): "保持不变",
+    (-1, -1, 1): "增空仓", (-1, -1, -1): "减空仓", (-1, -1, 0): "保持不变",
+})
+del _cmp
+
 
 class MarketType(Enum):
     """市场类型枚举"""
@@ -35,9 +128,94 @@ class MarketType(Enum):
     FUND = "fund"           # 基金（不能做空）
 
 
+# 示例价格序列数据 "open|high|low|close|volume|amount"（实际应该动态获取）
+_PRICE_EXAMPLES = {
+    # 股票
+    '000001.SZ': "11.62|11.63|11.65|11.58|649886|755106",
+    # 期货
+    'ICL1.CFX': "7142.6|7096.2|7173.6|7083.2|37364|5331950",
+    # 外汇
+    'EURUSD.fxcm': "1.1050|1.1060|1.1040|1.1055|1000000|1105500",
+    # 贵金属
+    'Ag(T+D)': "15.463|15.425|15.641|15.21|900984|13933600000",
+    # 指数
+    '000001.SH': "3890.45|3878.23|3902.67|3871.78|513512000|738066000",
+    # 可转债
+    '123118.SZ': "1396.25|1288|1414|1269.75|220403|302360",
+    # 基金
+    '510300.SH': "34.50|34.60|34.40|34.55|100000|34550000",
+    # 期权
+    'MO2512-C-5800.CFX': "1535|1502.8|1544.6|1502.8|44|671.886",
+}
+
+
+# 市场配置（只读，所有实例共用）
+_MARKET_CONFIG: Mapping[str, Mapping[str, Any]] = MappingProxyType({
+    MarketType.STOCK.value: MappingProxyType({
+        'allow_short': False,
+        'leverage': 1,
+        'min_lots': 100,  # 最小交易单位（股）
+        'price_precision': 2,  # 价格精度
+        'volume_precision': 0,  # 数量精度
+    }),
+    MarketType.FUTURES.value: MappingProxyType({
+        'allow_short': True,
+        'leverage': 10,  # 期货通常有杠杆
+        'min_lots': 1,  # 最小交易单位（手）
+        'price_precision': 2,
+        'volume_precision': 0,
+    }),
+    MarketType.FOREX.value: MappingProxyType({
+        'allow_short': True,
+        'leverage': 10,  # 外汇杠杆
+        'min_lots': 1000,  # 外汇最小单位
+        'price_precision': 4,
+        'volume_precision': 0,
+    }),
+    MarketType.OPTION.value: MappingProxyType({
+        'allow_short': True,
+        'leverage': 10,
+        'min_lots': 1,  # 期权最小单位（张）
+        'price_precision': 4,
+        'volume_precision': 0,
+    }),
+    MarketType.GOLD.value: MappingProxyType({
+        'allow_short': True,
+        'leverage': 1,
+        'min_lots': 1,
+        'price_precision': 2,
+        'volume_precision': 0,
+    }),
+    MarketType.INDEX.value: MappingProxyType({
+        'allow_short': False,
+        'leverage': 1,
+        'min_lots': 1,
+        'price_precision': 2,
+        'volume_precision': 0,
+    }),
+    MarketType.BOND.value: MappingProxyType({
+        'allow_short': False,
+        'leverage': 1,
+        'min_lots': 1,
+        'price_precision': 2,
+        'volume_precision': 0,
+    }),
+    MarketType.FUND.value: MappingProxyType({
+        'allow_short': False,
+        'leverage': 1,
+        'min_lots': 1,
+        'price_precision': 2,
+        'volume_precision': 0,
+    }),
+})
+
+
 class SymbolInfo:
     """交易品种信息"""
     
+    __slots__ = ('symbol', 'market_type', 'name', 'allow_short', 'leverage', 'per_symbol_capital',
+                 '_market_str', '_min_lots', '_predict_payload', '_history_params', '_price_seq')
+    
     def __init__(self, symbol: str, market_type: MarketType, name: str = "", 
                  allow_short: bool = False, leverage: int = 1,
                  per_symbol_capital: float = None):
@@ -59,13 +237,143 @@ class SymbolInfo:
         self.leverage = leverage
         self.per_symbol_capital = per_symbol_capital
         
+        # 以下字段由MultiMarketTrader根据市场配置预先计算，避免热路径上重复查找
+        self._market_str: Optional[str] = None
+        self._min_lots = 1
+        # 实时预测请求体中除价格外的固定部分
+        self._predict_payload: Dict[str, Any] = {}
+        # 历史数据查询参数中除API密钥和日期外的固定部分
+        self._history_params: Dict[str, Any] = {}
+        # 价格序列字符串
+        self._price_seq = "0|0|0|0|0|0"
+        
     def __str__(self):
         return f"{self.symbol} ({self.name}) - {self.market_type.value}"
 
 
+class Position:
+    """单个品种的持仓记录"""
+    
+    __slots__ = ('target_position', 'current_units', 'position_type', 'allocated_capital',
+                 'last_update', 'reason', 'market_type', 'symbol_name', 'leverage')
+    
+    def __init__(self, target_position: float = 0.0, current_units: int = 0,
+                 position_type: str = 'flat', allocated_capital: float = 0.0,
+                 last_update: str = "", reason: str = "", market_type: str = 'unknown',
+                 symbol_name: str = "", leverage: int = 1):
+        """
+        初始化持仓记录
+        
+        Args:
+            target_position: 目标仓位比例（-1~1）
+            current_units: 当前持仓单位（空头为负）
+            position_type: 持仓方向 'long'/'short'/'flat'
+            allocated_capital: 分配给该合约的资金（元）
+            last_update: 最后更新时间
+            reason: 调整原因
+            market_type: 市场类型
+            symbol_name: 品种名称
+            leverage: 杠杆倍数
+        """
+        self.target_position = target_position
+        self.current_units = current_units
+        self.position_type = position_type
+        self.allocated_capital = allocated_capital
+        self.last_update = last_update
+        self.reason = reason
+        self.market_type = market_type
+        self.symbol_name = symbol_name
+        self.leverage = leverage
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为可序列化的字典"""
+        return {name: getattr(self, name) for name in self.__slots__}
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Position':
+        """从字典恢复持仓记录，忽略未知字段"""
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+
+class BoundedRetry(Retry):
+    """
+    接口重试策略：
+    - Retry-After 的等待时间不超过 MAX_RETRY_AFTER 秒，避免服务端要求的长时间等待
+      阻塞定时任务和线程池
+    - POST 请求（预测接口按次计费）只在连接失败和429时重试：这两种情况服务端尚未处理请求；
+      读超时和5xx时请求可能已被处理并扣除额度，直接抛出不再重发
+    """
+    
+    MAX_RETRY_AFTER = 10.0
+    
+    @staticmethod
+    def _is_post(method) -> bool:
+        return bool(method) and method.upper() == 'POST'
+    
+    def get_retry_after(self, response) -> Optional[float]:
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, self.MAX_RETRY_AFTER)
+    
+    def is_retry(self, method, status_code, has_retry_after=False) -> bool:
+        if self._is_post(method) and status_code != 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+    
+    def increment(self, method=None, url=None, response=None, error=None,
+                  _pool=None, _stacktrace=None):
+        if self._is_post(method) and error is not None and self._is_read_error(error):
+            # read=False 时父类直接重新抛出该错误
+            return super(BoundedRetry, self.new(read=False)).increment(
+                method, url, response, error, _pool, _stacktrace)
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class TokenBucket:
+    """线程安全的令牌桶限流器"""
+    
+    def __init__(self, rate: float, capacity: int):
+        """
+        初始化令牌桶
+        
+        Args:
+            rate: 每秒补充的令牌数（允许的平均请求频率）
+            capacity: 令牌桶容量（允许的突发请求数）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """取得一个令牌，令牌不足时阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
 class MultiMarketTrader:
     """多市场交易策略"""
     
+    # 剩余调用次数低于该值时暂停发起请求，为人工查询和重试保留余量
+    QUOTA_SAFETY_MARGIN = 5
+    # 额度不足暂停后，每隔该秒数放行一次请求，用响应中的剩余次数重新确认额度
+    QUOTA_RECHECK_INTERVAL = 1800
+    # 接口请求频率上限（每秒请求数）和允许的突发请求数
+    API_RATE_LIMIT = 5.0
+    API_BURST = 5
+    # 当前价格的缓存秒数，同一轮调整和汇总内复用同一价格
+    PRICE_CACHE_TTL = 5.0
+    
     def __init__(self, api_key: str, symbols: List[SymbolInfo], 
                  per_symbol_capital: float = 100000.0,
                  host: str = "www.uqtool.com"):
@@ -87,6 +395,11 @@ class MultiMarketTrader:
         self.current_payment_type = 'free'
         self.api_usage_today = 0
         self.api_daily_limit = 0
+        # 接口额度：根据最近一次响应中的剩余次数限制请求，避免超额后被限流
+        self._quota_lock = threading.Lock()
+        self._quota_known = False
+        self._quota_blocked_at = None
+        self._rate_limiter = TokenBucket(self.API_RATE_LIMIT, self.API_BURST)
         # 计算总资产：每个合约资金 × 合约数量
         self.total_account_value = sum([symbol.per_symbol_capital for symbol in symbols])
         
@@ -96,13 +409,74 @@ class MultiMarketTrader:
                 symbol.per_symbol_capital = per_symbol_capital
         
         self.base_url =f"https://{self.host}/wp-json/swtool/v1"
+        self._predict_url = f"{self.base_url}/predict/"
+        self._history_url = f"{self.base_url}/history/"
+        
+        # 复用HTTP连接池：所有接口请求共用一个Session，避免每次请求重新握手
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max(1, len(symbols)),
+            pool_maxsize=max(10, len(symbols) * 2),
+            # 瞬时错误（限流、5xx）由适配器按指数退避自动重试，遵循Retry-After但等待有上限；
+            # POST只重试连接失败和429，见BoundedRetry；
+            # 最坏耗时约为 (重试次数+1) × timeout + 重试次数 × BoundedRetry.MAX_RETRY_AFTER
+            max_retries=BoundedRetry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(['GET', 'POST']),
+                respect_retry_after_header=True
+            )
+        )
+        self.session.mount('https://', adapter)
+        # requests默认已发送 Accept-Encoding: gzip, deflate 和 Connection: keep-alive
+        self.session.headers.update({'X-API-KEY': self.api_key})
+        self.warm_up_connection()
+        
+        # 各品种的接口请求相互独立且为网络I/O，用线程池并发执行
+        self.executor = ThreadPoolExecutor(max_workers=min(32, max(1, len(symbols) * 2)))
+        
+        # 记录当前持仓 {symbol: Position}
+        self.positions: Dict[str, Position] = {}
+        
+        # 历史数据缓存 {(symbol, trading_date): 最新一条记录}，交易日内数据不变
+        self._history_cache: Dict[Tuple[str, str], Dict] = {}
+        
+        self._history_cache_lock = threading.Lock()
+        # 内存缓存有未写入磁盘的新记录
+        self._history_cache_dirty = False
+        self._use_disk_cache = os.environ.get('UQTOOL_FRESH') != '1'
+        
+        # 当前价格缓存 {symbol: (写入时间, 价格)}
+        self._price_cache: Dict[str, Tuple[float, float]] = {}
         
-        # 记录当前持仓 {symbol: {'target_position': -1~1, 'current_units': int, 
-        # 'position_type': 'long'/'short', 'allocated_capital': float}}
-        self.positions: Dict[str, Dict] = {}
+        # 最近交易日缓存 (计算时的自然日, 交易日字符串)，跨日后重新计算
+        self._trading_date_cache: Tuple[Optional[date], str] = (None, "")
         
         # 市场配置
-        self.market_config = self.init_market_config()
+        self.market_config = _MARKET_CONFIG
+        
+        # 品种代码 -> SymbolInfo 索引，O(1)查找
+        self.symbols_by_code: Dict[str, SymbolInfo] = {s.symbol: s for s in self.symbols}
+        
+        # 预先计算各品种的静态参数
+        for symbol in self.symbols:
+            market_cfg = self.market_config.get(symbol.market_type.value, {})
+            symbol._market_str = symbol.market_type.value
+            symbol._min_lots = market_cfg.get('min_lots', 1)
+            symbol._predict_payload = {
+                'market': symbol._market_str,
+                'code': symbol.symbol,
+                'allow_short': 1 if symbol.allow_short else 0
+            }
+            symbol._price_seq = _PRICE_EXAMPLES.get(symbol.symbol, "0|0|0|0|0|0")
+            # SymbolInfo可能被多个交易实例共用，API密钥在构造请求时由各实例自行加入
+            symbol._history_params = {
+                'market': symbol._market_str,
+                'ts_code': symbol.symbol,
+                'table_type': 'basic',
+                'max_items': 10000
+            }
         
         logger.info("=" * 70)
         logger.info("UQTool 多市场交易策略启动")
@@ -116,78 +490,135 @@ class MultiMarketTrader:
                        f"({short_info}{leverage_info}{capital_info})")
         logger.info("=" * 70)
         
-        # 第一步：测试所有API接口
-        if not self.test_all_apis():
+        # 第一步：测试所有API接口（近期已测试通过则跳过）
+        if self.load_api_health():
+            logger.info("API接口近期已测试通过，跳过启动测试")
+        elif self.test_all_apis():
+            self.save_api_health()
+        else:
             logger.error("API测试失败，程序退出")
             return
         
         # 第二步：初始化最近交易日
         self.latest_trading_date = self.get_latest_trading_date()
         logger.info(f"最近交易日: {self.latest_trading_date}")
+        self.load_history_cache()
+        self.load_positions()
         
         # 第三步：启动时同步仓位
         self.startup_sync()
     
-    def init_market_config(self) -> Dict[str, Dict]:
-        """初始化市场配置"""
-        return {
-            MarketType.STOCK.value: {
-                'allow_short': False,
-                'leverage': 1,
-                'min_lots': 100,  # 最小交易单位（股）
-                'price_precision': 2,  # 价格精度
-                'volume_precision': 0,  # 数量精度
-            },
-            MarketType.FUTURES.value: {
-                'allow_short': True,
-                'leverage': 10,  # 期货通常有杠杆
-                'min_lots': 1,  # 最小交易单位（手）
-                'price_precision': 2,
-                'volume_precision': 0,
-            },
-            MarketType.FOREX.value: {
-                'allow_short': True,
-                'leverage': 10,  # 外汇杠杆
-                'min_lots': 1000,  # 外汇最小单位
-                'price_precision': 4,
-                'volume_precision': 0,
-            },
-            MarketType.OPTION.value: {
-                'allow_short': True,
-                'leverage': 10,
-                'min_lots': 1,  # 期权最小单位（张）
-                'price_precision': 4,
-                'volume_precision': 0,
-            },
-            MarketType.GOLD.value: {
-                'allow_short': True,
-                'leverage': 1,
-                'min_lots': 1,
-                'price_precision': 2,
-                'volume_precision': 0,
-            },
-            MarketType.INDEX.value: {
-                'allow_short': False,
-                'leverage': 1,
-                'min_lots': 1,
-                'price_precision': 2,
-                'volume_precision': 0,
-            },
-            MarketType.BOND.value: {
-                'allow_short': False,
-                'leverage': 1,
-                'min_lots': 1,
-                'price_precision': 2,
-                'volume_precision': 0,
-            },
-            MarketType.FUND.value: {
-                'allow_short': False,
-                'leverage': 1,
-                'min_lots': 1,
-                'price_precision': 2,
-                'volume_precision': 0,
-            },
-        }
+    def warm_up_connection(self):
+        """预先建立一个连接（DNS+TCP+TLS），后续并发请求直接复用连接池中的连接"""
+        url = f"https://{self.host}/"
+        # 预热只尝试一次：临时关闭连接池的重试，主机不可达时最多等待一个timeout
+        adapter = self.session.get_adapter(url)
+        max_retries = adapter.max_retries
+        adapter.max_retries = Retry(0, read=False)
+        try:
+            self.session.head(url, timeout=3, allow_redirects=False)
+        except requests.exceptions.RequestException as e:
+            logger.debug("预热连接失败: %s", e)
+        finally:
+            adapter.max_retries = max_retries
+    
+    def _update_quota(self, remaining, used_today=None, daily_limit=None):
+        """根据接口响应更新剩余调用次数"""
+        try:
+            remaining = int(remaining)
+        except (TypeError, ValueError):
+            return
+        with self._quota_lock:
+            self.current_remaining_calls = remaining
+            self._quota_known = True
+            self._quota_blocked_at = None
+            if used_today is not None:
+                self.api_usage_today = used_today
+            if daily_limit is not None:
+                self.api_daily_limit = daily_limit
+    
+    def _reset_quota(self):
+        """丢弃已知的剩余次数（如每日额度重置后），下一次请求的响应重新确认额度"""
+        with self._quota_lock:
+            self._quota_known = False
+            self._quota_blocked_at = None
+    
+    def _acquire_quota(self, weight: int = 1) -> bool:
+        """
+        发起请求前预扣额度
+        
+        Returns:
+            额度充足返回True；剩余次数已不足安全余量时返回False，本次请求应跳过。
+            暂停超过QUOTA_RECHECK_INTERVAL后放行一次请求，以便从响应中刷新额度
+        """
+        with self._quota_lock:
+            if not self._quota_known:
+                return True
+            if self.current_remaining_calls <= self.QUOTA_SAFETY_MARGIN:
+                now = time.monotonic()
+                if self._quota_blocked_at is None:
+                    self._quota_blocked_at = now
+                elif now - self._quota_blocked_at >= self.QUOTA_RECHECK_INTERVAL:
+                    self._quota_blocked_at = now
+                    logger.info("额度暂停已超过 %s 秒，放行一次请求以刷新剩余次数",
+                                self.QUOTA_RECHECK_INTERVAL)
+                    return True
+                logger.warning("API剩余次数不足 (剩余 %s, 今日已用 %s/%s)，跳过本次请求",
+                               self.current_remaining_calls, self.api_usage_today,
+                               self.api_daily_limit)
+                return False
+            self.current_remaining_calls -= weight
+            return True
+    
+    def _health_markets(self) -> List[str]:
+        """需要测试的市场列表"""
+        return sorted({symbol._market_str for symbol in self.symbols})
+    
+    def _api_key_digest(self) -> str:
+        """API密钥的摘要，用于区分健康缓存，不在磁盘上保存密钥原文"""
+        return hashlib.blake2b(self.api_key.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def load_api_health(self) -> bool:
+        """
+        读取接口健康检查缓存
+        
+        Returns:
+            同一主机、API密钥和市场组合在HEALTH_CACHE_TTL秒内测试通过返回True
+        """
+        if not self._use_disk_cache or not os.path.exists(HEALTH_CACHE_FILE):
+            return False
+        try:
+            with open(HEALTH_CACHE_FILE, 'rb') as f:
+                health = _loads(f.read())
+            return (health.get('ok') is True
+                    and health.get('host') == self.host
+                    and health.get('key') == self._api_key_digest()
+                    and health.get('markets') == self._health_markets()
+                    and time.time() - health.get('ts', 0) < HEALTH_CACHE_TTL)
+        except Exception as e:
+            logger.warning("读取接口健康缓存失败: %s", e)
+            return False
+    
+    def save_api_health(self):
+        """记录接口测试通过（原子写入）"""
+        if not self._use_disk_cache:
+            return
+        tmp_file = HEALTH_CACHE_FILE + '.tmp'
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(_dumps({'ts': time.time(), 'ok': True, 'host': self.host,
+                                'key': self._api_key_digest(),
+                                'markets': self._health_markets()}))
+            os.replace(tmp_file, HEALTH_CACHE_FILE)
+        except OSError as e:
+            logger.warning("保存接口健康缓存失败: %s", e)
+    
+    def invalidate_api_health(self):
+        """接口调用失败后删除健康缓存，下次启动重新测试"""
+        try:
+            os.remove(HEALTH_CACHE_FILE)
+        except OSError:
+            pass
     
     def test_all_apis(self) -> bool:
         """
@@ -200,26 +631,26 @@ class MultiMarketTrader:
         
         test_results = []
         
-        # 按市场类型分组测试
-        markets_to_test = {}
+        # 按市场类型分组测试（每个市场取第一个品种）
+        markets_to_test: Dict[str, SymbolInfo] = {}
         for symbol in self.symbols:
-            market = symbol.market_type.value
-            if market not in markets_to_test:
-                markets_to_test[market] = symbol
+            markets_to_test.setdefault(symbol._market_str, symbol)
         
-        # 测试每个市场的API
+        # 并发测试每个市场的API，按提交顺序收集结果
+        pending = []
         for market, test_symbol in markets_to_test.items():
             logger.info(f"测试 {market} 市场接口...")
             
             # 测试实时预测接口
-            realtime_result = self.test_realtime_api(test_symbol)
-            test_results.append((f"{market}实时接口", realtime_result))
+            pending.append((f"{market}实时接口",
+                            self.executor.submit(self.test_realtime_api, test_symbol)))
             
             # 测试历史数据接口
-            history_result = self.test_history_api(test_symbol)
-            test_results.append((f"{market}历史接口", history_result))
-            
-           # time.sleep(0.1)  # 避免请求过快
+            pending.append((f"{market}历史接口",
+                            self.executor.submit(self.test_history_api, test_symbol)))
+        
+        for api_name, future in pending:
+            test_results.append((api_name, future.result()))
         
         # 输出测试结果
         logger.info("\n" + "=" * 70)
@@ -253,25 +684,17 @@ class MultiMarketTrader:
         try:
             test_date = self.get_latest_trading_date()
             
-            url = f"{self.base_url}/history/"
-            params = {
-                'api_key': self.api_key,
-                'market': symbol_info.market_type.value,
-                'ts_code': symbol_info.symbol,
-                'start_date': test_date,
-                'end_date': test_date,
-                'table_type': 'basic',
-                'max_items': 10000
-            }
-            
-            headers = {'X-API-KEY': self.api_key}
+            url = self._history_url
+            params = {**symbol_info._history_params, 'api_key': self.api_key,
+                      'start_date': test_date, 'end_date': test_date}
             
+            self._rate_limiter.acquire()
             start_time = time.time()
-            response = requests.get(url, params=params, headers=headers, timeout=10)
+            response = self.session.get(url, params=params, timeout=10)
             elapsed_time = time.time() - start_time
             
             response.raise_for_status()
-            result = response.json()
+            result = _loads(response.content)
             
             # 新的响应格式：返回的是字典，包含 data 和 meta
             if isinstance(result, dict) and result.get('success'):
@@ -289,6 +712,8 @@ class MultiMarketTrader:
                 
                 # 使用 balance 字段，如果为0则尝试 user_points
                 actual_balance = balance if balance > 0 else user_points
+                # 响应中没有剩余次数时不更新额度，避免按默认值0误判额度耗尽
+                self._update_quota(api_info.get('remaining'), used_today, daily_limit)
                 
                 if isinstance(data, list):
                     if len(data) > 0:
@@ -299,7 +724,7 @@ class MultiMarketTrader:
                         # 判断仓位方向
                         if position != '未知':
                             position_float = float(position)
-                            direction = "多头" if position_float > 0 else ("空头" if position_float < 0 else "空仓")
+                            direction = _direction(position_float)
                             position_str = f"{position_float:.3f} ({direction})"
                         else:
                             position_str = "未知"
@@ -330,7 +755,7 @@ class MultiMarketTrader:
                         
                         if position != '未知':
                             position_float = float(position)
-                            direction = "多头" if position_float > 0 else ("空头" if position_float < 0 else "空仓")
+                            direction = _direction(position_float)
                             position_str = f"{position_float:.3f} ({direction})"
                         else:
                             position_str = "未知"
@@ -349,47 +774,37 @@ class MultiMarketTrader:
             return False, f"未知错误: {str(e)}"
 
     def get_latest_trading_date(self) -> str:
-        """获取最近交易日（处理周末情况）"""
+        """获取最近交易日（处理周末情况），同一自然日内复用缓存结果"""
         today = datetime.now()
+        cached_day, cached_date = self._trading_date_cache
+        if cached_day == today.date():
+            return cached_date
         
         # 如果是周末（周六=5, 周日=6），向前找到最近的周五
-        if today.weekday() == 5:  # 周六
-            trading_date = today - timedelta(days=1)
-        elif today.weekday() == 6:  # 周日
-            trading_date = today - timedelta(days=2)
-        else:
-            trading_date = today
+        trading_date = today - timedelta(days=_WEEKEND_ROLLBACK[today.weekday()])
         
-        return trading_date.strftime('%Y-%m-%d')
+        trading_date_str = trading_date.strftime('%Y-%m-%d')
+        self._trading_date_cache = (today.date(), trading_date_str)
+        
+        # 进入新的自然日，接口每日额度已重置，重新从响应中确认剩余次数
+        if cached_day is not None:
+            self._reset_quota()
+        
+        # 交易日变化后，旧交易日的历史数据缓存失效
+        if trading_date_str != cached_date:
+            with self._history_cache_lock:
+                self._history_cache.clear()
+        
+        return trading_date_str
     
     def get_price_sequence(self, symbol_info: SymbolInfo) -> str:
         """
         获取价格序列字符串
         格式: "open|high|low|close|volume|amount"
         
-        简化版：使用示例数据，实际应该从行情API获取
+        简化版：使用初始化时按品种预先查好的示例数据，实际应该从行情API获取
         """
-        # 示例价格数据（实际应该动态获取）
-        price_examples = {
-            # 股票
-            '000001.SZ': "11.62|11.63|11.65|11.58|649886|755106",
-            # 期货
-            'ICL1.CFX': "7142.6|7096.2|7173.6|7083.2|37364|5331950",
-            # 外汇
-            'EURUSD.fxcm': "1.1050|1.1060|1.1040|1.1055|1000000|1105500",
-            # 贵金属
-            'Ag(T+D)': "15.463|15.425|15.641|15.21|900984|13933600000",
-            # 指数
-            '000001.SH': "3890.45|3878.23|3902.67|3871.78|513512000|738066000",
-            # 可转债
-            '123118.SZ': "1396.25|1288|1414|1269.75|220403|302360",
-            # 基金
-            '510300.SH': "34.50|34.60|34.40|34.55|100000|34550000",
-            # 期权
-            'MO2512-C-5800.CFX': "1535|1502.8|1544.6|1502.8|44|671.886",
-        }
-        
-        return price_examples.get(symbol_info.symbol, "0|0|0|0|0|0")
+        return symbol_info._price_seq
     
     # 修改 test_realtime_api 函数
     def test_realtime_api(self, symbol_info: SymbolInfo) -> Tuple[bool, str]:
@@ -398,25 +813,17 @@ class MultiMarketTrader:
             # 获取测试价格数据
             price_sequence = self.get_price_sequence(symbol_info)
             
-            url = f"{self.base_url}/predict/"
-            headers = {
-                'Content-Type': 'application/json',
-                'X-API-KEY': self.api_key
-            }
+            url = self._predict_url
             
-            data = {
-                'market': symbol_info.market_type.value,
-                'code': symbol_info.symbol,
-                'price': price_sequence,
-                'allow_short': 1 if symbol_info.allow_short else 0
-            }
+            data = {**symbol_info._predict_payload, 'price': price_sequence}
             
+            self._rate_limiter.acquire()
             start_time = time.time()
-            response = requests.post(url, headers=headers, data=json.dumps(data), timeout=10)
+            response = self.session.post(url, data=_dumps(data), headers=JSON_HEADERS, timeout=10)
             elapsed_time = time.time() - start_time
             
             response.raise_for_status()
-            result = response.json()
+            result = _loads(response.content)
             
             if result.get('success'):
                 data = result.get('data', {})
@@ -429,11 +836,12 @@ class MultiMarketTrader:
                 api_info = data.get('api_info', {})
                 used_today = api_info.get('used_today', 0)
                 daily_limit = api_info.get('daily_limit', 0)
+                self._update_quota(remaining, used_today, daily_limit)
                 
                 # 判断仓位方向
                 if position is not None:
                     position_float = float(position)
-                    direction = "多头" if position_float > 0 else ("空头" if position_float < 0 else "空仓")
+                    direction = _direction(position_float)
                     position_str = f"{position_float:.3f} ({direction})"
                 else:
                     position_str = "未知"
@@ -465,29 +873,24 @@ class MultiMarketTrader:
         Returns:
             仓位比例（-1~1），失败返回None
         """
+        if not self._acquire_quota():
+            return None
+        
         try:
             # 获取价格序列
             price_sequence = self.get_price_sequence(symbol_info)
             
-            url = f"{self.base_url}/predict/"
-            headers = {
-                'Content-Type': 'application/json',
-                'X-API-KEY': self.api_key
-            }
+            url = self._predict_url
             
-            data = {
-                'market': symbol_info.market_type.value,
-                'code': symbol_info.symbol,
-                'price': price_sequence,
-                'allow_short': 1 if symbol_info.allow_short else 0
-            }
+            data = {**symbol_info._predict_payload, 'price': price_sequence}
             
-            logger.debug(f"请求实时预测: {symbol_info.symbol}, 市场: {symbol_info.market_type.value}")
+            logger.debug("请求实时预测: %s, 市场: %s", symbol_info.symbol, symbol_info._market_str)
             
-            response = requests.post(url, headers=headers, data=json.dumps(data), timeout=10)
+            self._rate_limiter.acquire()
+            response = self.session.post(url, data=_dumps(data), headers=JSON_HEADERS, timeout=10)
             response.raise_for_status()
             
-            result = response.json()
+            result = _loads(response.content)
             
             if result.get('success'):
                 data = result.get('data', {})
@@ -502,59 +905,95 @@ class MultiMarketTrader:
                 # 注意：API返回的是-1~1的仓位比例
                 # 例如：0.8 表示多头80%仓位，-0.8 表示空头80%仓位
                 
-                direction = "多头" if position > 0 else ("空头" if position < 0 else "空仓")
-                
-                # 记录积分信息
-                logger.info(f"实时预测 {symbol_info.symbol}: "
-                            f"仓位={position:.3f} ({direction}{abs(position)*100:.1f}%), "
-                            f"剩余积分={balance}, "
-                            f"剩余次数={remaining}, "
-                            f"支付方式={payment_type}")
+                # 记录积分信息（仅在INFO级别启用时格式化）
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("实时预测 %s: 仓位=%.3f (%s), 剩余积分=%s, 剩余次数=%s, 支付方式=%s",
+                                symbol_info.symbol, position, _direction_pct(position),
+                                balance, remaining, payment_type)
                 
                 # 存储当前积分和剩余次数到实例变量
                 self.current_balance = balance
-                self.current_remaining_calls = remaining
+                self._update_quota(data.get('remaining'), api_info.get('used_today'),
+                                   api_info.get('daily_limit'))
                 
                 return position
             else:
                 logger.error(f"实时预测失败 {symbol_info.symbol}: {result.get('message', '未知错误')}")
+                self.invalidate_api_health()
                 return None
                 
         except requests.exceptions.RequestException as e:
             logger.error(f"实时预测网络错误 {symbol_info.symbol}: {e}")
+            self.invalidate_api_health()
             return None
         except Exception as e:
             logger.error(f"实时预测未知错误 {symbol_info.symbol}: {e}")
             return None
 
-    def get_history_position(self, symbol_info: SymbolInfo) -> Optional[float]:
+    def close(self):
+        """写入未保存的历史数据缓存，释放线程池和HTTP连接池"""
+        self.flush_history_cache()
+        self.executor.shutdown(wait=False)
+        self.session.close()
+    
+    def map_symbols(self, func, symbols: List[SymbolInfo] = None) -> Dict[str, Any]:
         """
-        获取历史仓位（-1~1）
+        在线程池中对每个品种并发执行func
         
+        Args:
+            func: 接收SymbolInfo的函数
+            symbols: 交易品种列表，默认全部品种
+            
         Returns:
-            仓位比例（-1~1），失败返回None
+            {品种代码: func返回值}
         """
+        symbols = self.symbols if symbols is None else symbols
+        results = self.executor.map(func, symbols)
+        results = {symbol_info.symbol: result for symbol_info, result in zip(symbols, results)}
+        # 并发获取期间新增的历史数据在全部完成后一次性写入磁盘
+        self.flush_history_cache()
+        return results
+    
+    def refresh_all_positions(self) -> Dict[str, Optional[float]]:
+        """并发获取所有品种的实时预测仓位"""
+        return self.map_symbols(self.get_realtime_position)
+
+    def _fetch_history_row(self, symbol_info: SymbolInfo) -> Optional[Dict]:
+        """
+        获取最近交易日的最新一条历史数据（包含仓位和价格），按(品种, 交易日)缓存
+        
+        get_history_position 与 get_current_price 共用此结果，同一交易日只请求一次
+        
+        Returns:
+            最新一条历史记录，失败或无数据返回None
+        """
+        cache_key = (symbol_info.symbol, self.latest_trading_date)
+        cached = self._history_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        if not self._acquire_quota():
+            return None
+        
         try:
-            url = f"{self.base_url}/history/"
+            url = self._history_url
             
-            params = {
-                'api_key': self.api_key,
-                'market': symbol_info.market_type.value,
-                'ts_code': symbol_info.symbol,
-                'start_date': self.latest_trading_date,
-                'end_date': self.latest_trading_date,
-                'table_type': 'basic',
-                'max_items': 10000
-            }
+            params = {**symbol_info._history_params,
+                      'api_key': self.api_key,
+                      'start_date': self.latest_trading_date,
+                      'end_date': self.latest_trading_date}
             
-            headers = {'X-API-KEY': self.api_key}
+            logger.debug("查询历史数据: %s, 市场: %s", symbol_info.symbol, symbol_info._market_str)
             
-            logger.debug(f"查询历史仓位: {symbol_info.symbol}, 市场: {symbol_info.market_type.value}")
-            
-            response = requests.get(url, params=params, headers=headers, timeout=10)
+            self._rate_limiter.acquire()
+            response = self.session.get(url, params=params, timeout=10)
             response.raise_for_status()
             
-            result = response.json()
+            result = _loads(response.content)
+            
+            # 旧格式直接返回列表
+            if isinstance(result, list):
+                result = {'success': True, 'data': result}
             
             # 新的响应格式：包含 meta 信息
             if result.get('success'):
@@ -567,41 +1006,144 @@ class MultiMarketTrader:
                 used_today = api_info.get('used_today', 0)
                 daily_limit = api_info.get('daily_limit', 0)
                 payment_type = api_info.get('payment_type', 'free')
+                # 旧格式的列表响应没有meta，不能据此更新额度
+                self._update_quota(api_info.get('remaining'), used_today, daily_limit)
                 
-                logger.info(f"API使用信息: 今日已用 {used_today}/{daily_limit}, 剩余 {remaining}, 支付方式: {payment_type}")
+                logger.info("API使用信息: 今日已用 %s/%s, 剩余 %s, 支付方式: %s",
+                            used_today, daily_limit, remaining, payment_type)
                 
                 if isinstance(data, list) and len(data) > 0:
                     # 获取最新一条数据
-                    latest = data[0] if len(data) == 1 else sorted(data, 
-                        key=lambda x: x.get('trade_date', ''), reverse=True)[0]
-                    
-                    # 注意：历史数据中的position字段可能是字符串
-                    position_str = latest.get('position')
-                    if position_str is not None:
-                        position = float(position_str)
-                        trade_date = latest.get('trade_date', '未知')
-                        
-                        direction = "多头" if position > 0 else ("空头" if position < 0 else "空仓")
-                        logger.info(f"历史仓位 {symbol_info.symbol}: 日期={trade_date}, 仓位={position:.3f} ({direction})")
-                        return position
-                    else:
-                        logger.warning(f"历史数据中未找到position字段 {symbol_info.symbol}")
-                        return None
+                    latest = max(data, key=lambda x: x.get('trade_date') or '')
+                    with self._history_cache_lock:
+                        self._history_cache[cache_key] = latest
+                        self._history_cache_dirty = True
+                    return latest
                 else:
-                    logger.warning(f"无历史数据 {symbol_info.symbol}, 日期: {self.latest_trading_date}")
+                    logger.warning("无历史数据 %s, 日期: %s",
+                                   symbol_info.symbol, self.latest_trading_date)
                     return None
             else:
                 logger.error(f"API返回失败: {result.get('message', '未知错误')}")
+                self.invalidate_api_health()
                 return None
                     
         except requests.exceptions.RequestException as e:
             logger.error(f"历史数据网络错误 {symbol_info.symbol}: {e}")
+            self.invalidate_api_health()
             return None
         except Exception as e:
             logger.error(f"历史数据处理错误 {symbol_info.symbol}: {e}")
             return None
 
+    def load_history_cache(self):
+        """从磁盘加载最近交易日的历史数据缓存"""
+        if not self._use_disk_cache or not os.path.exists(HISTORY_CACHE_FILE):
+            return
+        try:
+            with open(HISTORY_CACHE_FILE, 'rb') as f:
+                cached = _loads(f.read())
+            if cached.get('trading_date') != self.latest_trading_date:
+                return
+            rows = cached.get('rows', {})
+            with self._history_cache_lock:
+                for symbol, row in rows.items():
+                    self._history_cache[(symbol, self.latest_trading_date)] = row
+            logger.info("从磁盘缓存加载 %d 条历史数据 (%s)", len(rows), self.latest_trading_date)
+        except Exception as e:
+            logger.warning("加载历史数据缓存失败: %s", e)
+    
+    def save_history_cache(self):
+        """将最近交易日的历史数据缓存原子写入磁盘"""
+        if not self._use_disk_cache:
+            return
+        with self._history_cache_lock:
+            rows = {symbol: row for (symbol, trading_date), row in self._history_cache.items()
+                    if trading_date == self.latest_trading_date}
+            tmp_file = HISTORY_CACHE_FILE + '.tmp'
+            try:
+                with open(tmp_file, 'wb') as f:
+                    f.write(_dumps({'trading_date': self.latest_trading_date, 'rows': rows}))
+                os.replace(tmp_file, HISTORY_CACHE_FILE)
+                self._history_cache_dirty = False
+            except OSError as e:
+                logger.warning("保存历史数据缓存失败: %s", e)
+
+    def flush_history_cache(self):
+        """历史数据缓存有新记录时写入磁盘"""
+        if self._history_cache_dirty:
+            self.save_history_cache()
+    
+    def load_positions(self):
+        """从磁盘加载上次运行保存的持仓记录（仅当前交易品种）"""
+        if not self._use_disk_cache or not os.path.exists(POSITIONS_FILE):
+            return
+        try:
+            with open(POSITIONS_FILE, 'rb') as f:
+                saved = _loads(f.read())
+            for symbol, data in saved.items():
+                if symbol in self.symbols_by_code:
+                    self.positions[symbol] = Position.from_dict(data)
+            logger.info("从磁盘加载 %d 条持仓记录", len(self.positions))
+        except Exception as e:
+            logger.warning("加载持仓记录失败: %s", e)
+    
+    def save_positions(self):
+        """将持仓记录原子写入磁盘"""
+        if not self._use_disk_cache:
+            return
+        tmp_file = POSITIONS_FILE + '.tmp'
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(_dumps({symbol: pos.to_dict() for symbol, pos in self.positions.items()}))
+            os.replace(tmp_file, POSITIONS_FILE)
+        except OSError as e:
+            logger.warning("保存持仓记录失败: %s", e)
+
+    def get_history_position(self, symbol_info: SymbolInfo) -> Optional[float]:
+        """
+        获取历史仓位（-1~1）
+        
+        Returns:
+            仓位比例（-1~1），失败返回None
+        """
+        latest = self._fetch_history_row(symbol_info)
+        if latest is None:
+            return None
+        
+        # 注意：历史数据中的position字段可能是字符串
+        position_str = latest.get('position')
+        if position_str is None:
+            logger.warning(f"历史数据中未找到position字段 {symbol_info.symbol}")
+            return None
+        
+        try:
+            position = float(position_str)
+        except (TypeError, ValueError) as e:
+            logger.error(f"历史数据处理错误 {symbol_info.symbol}: {e}")
+            return None
+        
+        trade_date = latest.get('trade_date', '未知')
+        direction = _direction(position)
+        logger.info("历史仓位 %s: 日期=%s, 仓位=%.3f (%s)",
+                    symbol_info.symbol, trade_date, position, direction)
+        return position
+
     def get_current_price(self, symbol_info: SymbolInfo) -> Optional[float]:
+        """
+        获取当前价格，PRICE_CACHE_TTL秒内复用上次结果
+        """
+        cached = self._price_cache.get(symbol_info.symbol)
+        now = time.monotonic()
+        if cached is not None and now - cached[0] < self.PRICE_CACHE_TTL:
+            return cached[1]
+        
+        price = self._load_current_price(symbol_info)
+        if price is not None:
+            self._price_cache[symbol_info.symbol] = (now, price)
+        return price
+    
+    def _load_current_price(self, symbol_info: SymbolInfo) -> Optional[float]:
         """
         获取当前价格（简化版）
         实际应该从行情API获取
@@ -649,74 +1191,41 @@ class MultiMarketTrader:
     
     def get_history_position_data(self, symbol_info: SymbolInfo) -> Optional[Dict]:
         """获取历史仓位数据（包含价格信息）"""
-        try:
-            url = f"{self.base_url}/history/"
-            
-            params = {
-                'api_key': self.api_key,
-                'market': symbol_info.market_type.value,
-                'ts_code': symbol_info.symbol,
-                'start_date': self.latest_trading_date,
-                'end_date': self.latest_trading_date,
-                'table_type': 'basic',
-                'max_items': 10000
-            }
-            
-            headers = {'X-API-KEY': self.api_key}
-            
-            response = requests.get(url, params=params, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if isinstance(data, list) and len(data) > 0:
-                return data[0]
-                
-        except:
-            pass
-        return None
+        return self._fetch_history_row(symbol_info)
     
-    def calculate_target_units(self, symbol_info: SymbolInfo, target_position: float) -> int:
+    def calculate_target_units(self, symbol_info: SymbolInfo, target_position: float,
+                               current_price: Optional[float] = None) -> int:
         """
         计算目标交易单位数量
         
         Args:
             symbol_info: 交易品种信息
             target_position: 目标仓位比例（-1~1）
+            current_price: 当前价格，未提供时自动获取
             
         Returns:
             目标交易单位数量
         """
-        current_price = self.get_current_price(symbol_info)
+        if current_price is None:
+            current_price = self.get_current_price(symbol_info)
         if current_price is None or current_price <= 0:
             logger.error(f"无法获取有效价格 {symbol_info.symbol}")
             return 0
         
-        # 获取市场配置
-        market_cfg = self.market_config.get(symbol_info.market_type.value, {})
-        min_lots = market_cfg.get('min_lots', 1)
-        
-        # 使用分配给该合约的资金（不是总资产）
+        # 最小交易单位已在初始化时预先计算；分配资金（不是总资产）和杠杆可能在运行中调整，按当前值计算
+        min_lots = symbol_info._min_lots
         allocated_capital = symbol_info.per_symbol_capital
         
-        # 考虑杠杆
-        effective_capital = allocated_capital * symbol_info.leverage
-        
         # 计算目标市值（注意：空头仓位用负值计算）
-        target_value = effective_capital * target_position
+        target_value = allocated_capital * symbol_info.leverage * target_position
         
-        # 计算目标单位数量
-        if target_position >= 0:  # 多头
-            target_units = int(abs(target_value) / current_price / min_lots) * min_lots
-        else:  # 空头
-            target_units = -int(abs(target_value) / current_price / min_lots) * min_lots
-        
-        logger.debug(f"计算目标单位 {symbol_info.symbol}: "
-                    f"分配资金={allocated_capital:.2f}, "
-                    f"价格={current_price:.4f}, "
-                    f"目标仓位={target_position:.3f}, "
-                    f"目标市值={target_value:.2f}, "
-                    f"目标单位={target_units}")
+        # 计算目标单位数量（按最小交易单位向下取整，空头为负）
+        sign = 1 if target_position >= 0 else -1
+        target_units = sign * (int(abs(target_value) / current_price) // min_lots) * min_lots
+        
+        logger.debug("计算目标单位 %s: 分配资金=%.2f, 价格=%.4f, 目标仓位=%.3f, 目标市值=%.2f, 目标单位=%d",
+                     symbol_info.symbol, allocated_capital, current_price,
+                     target_position, target_value, target_units)
         
         return target_units
     
@@ -727,39 +1236,12 @@ class MultiMarketTrader:
         Returns:
             动作描述: '建多仓', '建空仓', '平多仓', '平空仓', '多转空', '空转多', '增仓', '减仓', '保持不变'
         """
-        if old_position == 0:
-            if new_position > 0:
-                return "建多仓"
-            elif new_position < 0:
-                return "建空仓"
-            else:
-                return "保持不变"
-        
-        elif old_position > 0:  # 原有多头仓位
-            if new_position == 0:
-                return "平多仓"
-            elif new_position < 0:  # 多转空
-                return "多转空"
-            elif new_position > old_position:
-                return "增多仓"
-            elif new_position < old_position:
-                return "减多仓"
-            else:
-                return "保持不变"
-        
-        else:  # old_position < 0, 原有空头仓位
-            if new_position == 0:
-                return "平空仓"
-            elif new_position > 0:  # 空转多
-                return "空转多"
-            elif abs(new_position) > abs(old_position):  # 增加空头仓位
-                return "增空仓"
-            elif abs(new_position) < abs(old_position):  # 减少空头仓位
-                return "减空仓"
-            else:
-                return "保持不变"
+        key = (_sign(old_position), _sign(new_position),
+               _sign(abs(new_position) - abs(old_position)))
+        return _ACTION_TABLE[key]
     
-    def execute_position_adjustment(self, symbol_info: SymbolInfo, target_position: float, reason: str):
+    def execute_position_adjustment(self, symbol_info: SymbolInfo, target_position: float, reason: str,
+                                    now_str: Optional[str] = None):
         """
         执行仓位调整
         
@@ -767,38 +1249,41 @@ class MultiMarketTrader:
             symbol_info: 交易品种信息
             target_position: 目标仓位比例（-1~1）
             reason: 调整原因
+            now_str: 更新时间字符串，批量调整时由调用方统一计算，默认取当前时间
         """
-        # 获取当前持仓
+        # 品种的不变属性只取一次
         symbol_key = symbol_info.symbol
-        current_pos = self.positions.get(symbol_key, {
-            'target_position': 0.0,
-            'current_units': 0,
-            'position_type': 'flat',
-            'allocated_capital': symbol_info.per_symbol_capital
-        })
+        leverage = symbol_info.leverage
         
-        old_position = current_pos['target_position']
-        old_units = current_pos['current_units']
-        allocated_capital = current_pos['allocated_capital']
+        # 获取当前持仓
+        current_pos = self.positions.get(symbol_key)
+        if current_pos is None:
+            current_pos = Position(allocated_capital=symbol_info.per_symbol_capital)
+        
+        old_position = current_pos.target_position
+        old_units = current_pos.current_units
+        allocated_capital = current_pos.allocated_capital
         
         # 判断调整动作
         action = self.get_position_action(old_position, target_position, symbol_info.allow_short)
         
         if action == "保持不变":
-            logger.info(f"{symbol_info.symbol}: 仓位保持不变 ({target_position:.3f})")
+            logger.info("%s: 仓位保持不变 (%.3f)", symbol_key, target_position)
             return
         
+        # 获取一次当前价格，计算目标数量和交易金额共用
+        current_price = self.get_current_price(symbol_info)
+        
         # 计算目标单位数量
-        target_units = self.calculate_target_units(symbol_info, target_position)
+        target_units = self.calculate_target_units(symbol_info, target_position, current_price)
         
         # 计算需要交易的数量
         units_to_trade = target_units - old_units
         
         if units_to_trade == 0:
-            logger.info(f"{symbol_info.symbol}: 仓位比例变化但数量不变 ({old_position:.3f}->{target_position:.3f})")
+            logger.info("%s: 仓位比例变化但数量不变 (%.3f->%.3f)", symbol_key, old_position, target_position)
         else:
-            # 获取当前价格
-            current_price = self.get_current_price(symbol_info) or 0
+            current_price = current_price or 0
             
             # 确定交易方向
             if units_to_trade > 0:
@@ -807,33 +1292,33 @@ class MultiMarketTrader:
                 trade_direction = "卖出平多" if old_units > 0 else "买入平空"
             
             # 计算交易金额（考虑杠杆）
-            trade_value = abs(units_to_trade) * current_price / symbol_info.leverage
+            trade_value = abs(units_to_trade) * current_price / leverage
             
-            logger.info(f"{symbol_info.symbol}: {action} {trade_direction}{abs(units_to_trade)}单位 "
-                      f"@ {current_price:.4f}, 占用资金={trade_value:.2f}元")
+            logger.info("%s: %s %s%d单位 @ %.4f, 占用资金=%.2f元",
+                        symbol_key, action, trade_direction, abs(units_to_trade),
+                        current_price, trade_value)
         
         # 更新持仓记录
         position_type = 'long' if target_position > 0 else ('short' if target_position < 0 else 'flat')
         
-        self.positions[symbol_key] = {
-            'target_position': target_position,
-            'current_units': target_units,
-            'position_type': position_type,
-            'allocated_capital': allocated_capital,
-            'last_update': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'reason': reason,
-            'market_type': symbol_info.market_type.value,
-            'symbol_name': symbol_info.name,
-            'leverage': symbol_info.leverage
-        }
-        
-        direction_old = "多头" if old_position > 0 else ("空头" if old_position < 0 else "空仓")
-        direction_new = "多头" if target_position > 0 else ("空头" if target_position < 0 else "空仓")
-        
-        logger.info(f"{symbol_info.symbol}: {action}完成 "
-                   f"({direction_old}{abs(old_position)*100:.1f}%->{direction_new}{abs(target_position)*100:.1f}%), "
-                   f"单位: {old_units}->{target_units}, "
-                   f"分配资金: {allocated_capital:.2f}元")
+        self.positions[symbol_key] = Position(
+            target_position=target_position,
+            current_units=target_units,
+            position_type=position_type,
+            allocated_capital=allocated_capital,
+            last_update=now_str or time.strftime('%Y-%m-%d %H:%M:%S'),
+            reason=reason,
+            market_type=symbol_info._market_str,
+            symbol_name=symbol_info.name,
+            leverage=leverage
+        )
+        self.save_positions()
+        
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("%s: %s完成 (%s->%s), 单位: %d->%d, 分配资金: %.2f元",
+                        symbol_key, action,
+                        _direction_pct(old_position), _direction_pct(target_position),
+                        old_units, target_units, allocated_capital)
     
     def startup_sync(self):
         """启动时同步仓位"""
@@ -858,64 +1343,100 @@ class MultiMarketTrader:
         """同步所有交易品种的仓位"""
         logger.info(f"开始同步所有品种 ({data_source})...")
         
+        # 先并发获取所有品种的目标仓位，再在当前线程内依次调整持仓
+        if data_source == "realtime":
+            targets = self.map_symbols(self.get_realtime_position)
+            reason = f"{reason_prefix} - 实时预测"
+        else:
+            targets = self.map_symbols(self.get_history_position)
+            reason = f"{reason_prefix} - 历史数据"
+        now_str = time.strftime('%Y-%m-%d %H:%M:%S')
+        
         for symbol_info in self.symbols:
             try:
-                if data_source == "realtime":
-                    target_position = self.get_realtime_position(symbol_info)
-                    reason = f"{reason_prefix} - 实时预测"
-                else:
-                    target_position = self.get_history_position(symbol_info)
-                    reason = f"{reason_prefix} - 历史数据"
-                
-                if target_position is not None:
-                    # 确保仓位在-1~1范围内
-                    target_position = max(-1.0, min(1.0, target_position))
-                    
-                    # 如果不允许做空但仓位为负，调整为0
-                    if not symbol_info.allow_short and target_position < 0:
-                        logger.warning(f"{symbol_info.symbol} 不允许做空，空头仓位{target_position:.3f}调整为0")
-                        target_position = 0.0
-                    
-                    self.execute_position_adjustment(symbol_info, target_position, reason)
-                else:
-                    logger.warning(f"无法获取 {symbol_info.symbol} 的仓位数据")
-                
-               # time.sleep(0.1)  # 避免请求过快
-                
+                self._sync_symbol(symbol_info, targets[symbol_info.symbol], reason, now_str, "仓位数据")
             except Exception as e:
-                logger.error(f"同步 {symbol_info.symbol} 仓位时出错: {e}")
+                logger.error("同步 %s 仓位时出错: %s", symbol_info.symbol, e)
         
         logger.info("同步完成")
         self.print_position_summary()
     
-    def print_position_summary(self):
-        """打印仓位汇总"""
-        logger.info("\n" + "-" * 80)
-        logger.info("当前仓位汇总:")
-        logger.info("-" * 80)
+    def _sync_symbol(self, symbol_info: SymbolInfo, target_position: Optional[float],
+                     reason: str, now_str: str, source_name: str):
+        """
+        按目标仓位同步单个品种：限制在-1~1范围内，不允许做空时空头调整为0，
+        与当前持仓相差不超过0.1%时跳过
+        
+        Args:
+            target_position: 获取到的目标仓位，None表示获取失败
+            source_name: 数据来源名称，用于日志
+        """
+        if target_position is None:
+            logger.warning("无法获取 %s 的%s", symbol_info.symbol, source_name)
+            return
+        
+        # 确保仓位在-1~1范围内
+        target_position = max(-1.0, min(1.0, target_position))
+        
+        # 如果不允许做空但仓位为负，调整为0
+        if not symbol_info.allow_short and target_position < 0:
+            logger.warning("%s 不允许做空，空头仓位%.3f调整为0", symbol_info.symbol, target_position)
+            target_position = 0.0
+        
+        # 与当前持仓一致时跳过调整
+        current_pos = self.positions.get(symbol_info.symbol)
+        old_position = current_pos.target_position if current_pos else 0.0
+        
+        if abs(target_position - old_position) > 0.001:  # 容忍0.1%的差异
+            self.execute_position_adjustment(symbol_info, target_position, reason, now_str)
+        elif logger.isEnabledFor(logging.INFO):
+            logger.info("%s: 仓位一致，无需调整 (%s)",
+                        symbol_info.symbol, _direction_pct(target_position))
+    
+    def _snapshot_prices(self) -> Dict[str, Optional[float]]:
+        """并发获取所有持仓品种的当前价格快照 {品种代码: 价格}"""
+        held_symbols = [s for s in self.symbols if s.symbol in self.positions]
+        return self.map_symbols(self.get_current_price, held_symbols)
+    
+    def print_position_summary(self, prices: Optional[Dict[str, Optional[float]]] = None):
+        """
+        打印仓位汇总，整份汇总合并为一条日志输出
+        
+        Args:
+            prices: 价格快照 {品种代码: 价格}，未提供时自动并发获取
+        """
+        # 汇总只用于日志输出，INFO级别未启用时无需取价和计算
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        
+        lines = ["", "-" * 80, "当前仓位汇总:", "-" * 80]
         
         total_position_value = 0
         long_value = 0
         short_value = 0
         total_allocated_capital = 0
         
+        # 预先取得所有持仓品种的价格，汇总循环内只做计算和输出
+        if prices is None:
+            prices = self._snapshot_prices()
+        
         for symbol_key, pos_info in self.positions.items():
-            target_position = pos_info['target_position']
-            current_units = pos_info['current_units']
-            position_type = pos_info.get('position_type', 'flat')
-            market_type = pos_info.get('market_type', 'unknown')
-            symbol_name = pos_info.get('symbol_name', symbol_key)
-            allocated_capital = pos_info.get('allocated_capital', 0)
-            leverage = pos_info.get('leverage', 1)
+            target_position = pos_info.target_position
+            current_units = pos_info.current_units
+            position_type = pos_info.position_type
+            market_type = pos_info.market_type
+            symbol_name = pos_info.symbol_name or symbol_key
+            allocated_capital = pos_info.allocated_capital
+            leverage = pos_info.leverage
             
             total_allocated_capital += allocated_capital
             
             # 找到对应的symbol_info
-            symbol_info = next((s for s in self.symbols if s.symbol == symbol_key), None)
+            symbol_info = self.symbols_by_code.get(symbol_key)
             
             if symbol_info:
                 # 计算当前市值
-                current_price = self.get_current_price(symbol_info) or 0
+                current_price = prices.get(symbol_key) or 0
                 
                 if position_type == 'long':
                     position_value = abs(current_units) * current_price / leverage
@@ -931,119 +1452,76 @@ class MultiMarketTrader:
                 # 计算实际仓位比例（相对于该合约分配的资金）
                 position_ratio = position_value / allocated_capital if allocated_capital > 0 else 0
                 
-                direction = "多头" if target_position > 0 else ("空头" if target_position < 0 else "空仓")
-                
-                logger.info(f"{symbol_key} ({symbol_name} - {market_type}):")
-                logger.info(f"  目标仓位: {target_position:.3f} ({direction}{abs(target_position)*100:.1f}%)")
-                logger.info(f"  实际仓位: {position_ratio:.3f} ({position_ratio*100:.1f}%)")
-                logger.info(f"  持仓方向: {position_type}")
-                logger.info(f"  持仓单位: {current_units}")
-                logger.info(f"  当前价格: {current_price:.4f}")
-                logger.info(f"  持仓市值: {position_value:.2f}元")
-                logger.info(f"  分配资金: {allocated_capital:.2f}元")
+                lines.append(f"{symbol_key} ({symbol_name} - {market_type}):")
+                lines.append(f"  目标仓位: {target_position:.3f} ({_direction_pct(target_position)})")
+                lines.append(f"  实际仓位: {position_ratio:.3f} ({position_ratio*100:.1f}%)")
+                lines.append(f"  持仓方向: {position_type}")
+                lines.append(f"  持仓单位: {current_units}")
+                lines.append(f"  当前价格: {current_price:.4f}")
+                lines.append(f"  持仓市值: {position_value:.2f}元")
+                lines.append(f"  分配资金: {allocated_capital:.2f}元")
                 if leverage > 1:
-                    logger.info(f"  杠杆倍数: {leverage}X")
-                logger.info("")
+                    lines.append(f"  杠杆倍数: {leverage}X")
+                lines.append("")
         
-        logger.info(f"多头总市值: {long_value:.2f}元")
-        logger.info(f"空头总市值: {short_value:.2f}元")
-        logger.info(f"净持仓市值: {total_position_value:.2f}元")
-        logger.info(f"分配总资金: {total_allocated_capital:.2f}元")
-        logger.info(f"账户总资产: {self.total_account_value:.2f}元")
+        lines.append(f"多头总市值: {long_value:.2f}元")
+        lines.append(f"空头总市值: {short_value:.2f}元")
+        lines.append(f"净持仓市值: {total_position_value:.2f}元")
+        lines.append(f"分配总资金: {total_allocated_capital:.2f}元")
+        lines.append(f"账户总资产: {self.total_account_value:.2f}元")
         
         # 计算相对于总资产的仓位比例
         if self.total_account_value > 0:
             total_position_ratio = total_position_value / self.total_account_value
-            logger.info(f"总仓位比例: {total_position_ratio:.3f} ({total_position_ratio*100:.1f}%)")
+            lines.append(f"总仓位比例: {total_position_ratio:.3f} ({total_position_ratio*100:.1f}%)")
         
         # 计算风险指标（相对于总资产）
         gross_exposure = (long_value + abs(short_value)) / self.total_account_value
         net_exposure = total_position_value / self.total_account_value
-        logger.info(f"总风险敞口: {gross_exposure:.3f} ({gross_exposure*100:.1f}%)")
-        logger.info(f"净风险敞口: {net_exposure:.3f} ({net_exposure*100:.1f}%)")
+        lines.append(f"总风险敞口: {gross_exposure:.3f} ({gross_exposure*100:.1f}%)")
+        lines.append(f"净风险敞口: {net_exposure:.3f} ({net_exposure*100:.1f}%)")
         
         # 计算资金利用率
         if total_allocated_capital > 0:
             capital_utilization = (long_value + abs(short_value)) / total_allocated_capital
-            logger.info(f"资金利用率: {capital_utilization:.3f} ({capital_utilization*100:.1f}%)")
+            lines.append(f"资金利用率: {capital_utilization:.3f} ({capital_utilization*100:.1f}%)")
         
-        logger.info("-" * 80)
+        lines.append("-" * 80)
+        logger.info("\n".join(lines))
     
-    def check_and_sync_morning(self):
-        """早盘检查并同步"""
-        current_time = datetime.now().strftime('%H:%M:%S')
+    def _check_and_sync(self, source_fn, label: str, source_name: str):
+        """
+        定时检查并同步所有品种的仓位
+        
+        Args:
+            source_fn: 获取目标仓位的方法（get_history_position 或 get_realtime_position）
+            label: 检查时段名称，如 '早盘'、'尾盘'
+            source_name: 数据来源名称，用于日志
+        """
+        self.latest_trading_date = self.get_latest_trading_date()
+        current_time = time.strftime('%H:%M:%S')
         logger.info(f"\n{'='*70}")
-        logger.info(f"早盘检查 {current_time}")
+        logger.info("%s检查 %s", label, current_time)
         logger.info('='*70)
         
+        # 并发获取所有品种的目标仓位
+        targets = self.map_symbols(source_fn)
+        now_str = time.strftime('%Y-%m-%d %H:%M:%S')
+        reason = f"{label}同步"
+        
         for symbol_info in self.symbols:
             try:
-                # 早盘使用历史数据
-                target_position = self.get_history_position(symbol_info)
-                
-                if target_position is not None:
-                    # 确保仓位在-1~1范围内
-                    target_position = max(-1.0, min(1.0, target_position))
-                    
-                    # 如果不允许做空但仓位为负，调整为0
-                    if not symbol_info.allow_short and target_position < 0:
-                        target_position = 0.0
-                    
-                    # 获取当前持仓
-                    current_pos = self.positions.get(symbol_info.symbol, {'target_position': 0.0})
-                    old_position = current_pos['target_position']
-                    
-                    # 判断是否需要调整
-                    if abs(target_position - old_position) > 0.001:  # 容忍0.1%的差异
-                        self.execute_position_adjustment(symbol_info, target_position, "早盘同步")
-                    else:
-                        direction = "多头" if target_position > 0 else ("空头" if target_position < 0 else "空仓")
-                        logger.info(f"{symbol_info.symbol}: 仓位一致，无需调整 ({direction}{abs(target_position)*100:.1f}%)")
-                else:
-                    logger.warning(f"无法获取 {symbol_info.symbol} 的历史仓位")
-                
-               # time.sleep(0.1)
-                
+                self._sync_symbol(symbol_info, targets[symbol_info.symbol], reason, now_str, source_name)
             except Exception as e:
-                logger.error(f"处理 {symbol_info.symbol} 早盘检查时出错: {e}")
+                logger.error("处理 %s %s检查时出错: %s", symbol_info.symbol, label, e)
+    
+    def check_and_sync_morning(self):
+        """早盘检查并同步（使用历史数据）"""
+        self._check_and_sync(self.get_history_position, "早盘", "历史仓位")
     
     def check_and_sync_late(self):
-        """尾盘检查并同步"""
-        current_time = datetime.now().strftime('%H:%M:%S')
-        logger.info(f"\n{'='*70}")
-        logger.info(f"尾盘检查 {current_time}")
-        logger.info('='*70)
-        
-        for symbol_info in self.symbols:
-            try:
-                # 尾盘使用实时预测
-                target_position = self.get_realtime_position(symbol_info)
-                
-                if target_position is not None:
-                    # 确保仓位在-1~1范围内
-                    target_position = max(-1.0, min(1.0, target_position))
-                    
-                    # 如果不允许做空但仓位为负，调整为0
-                    if not symbol_info.allow_short and target_position < 0:
-                        target_position = 0.0
-                    
-                    # 获取当前持仓
-                    current_pos = self.positions.get(symbol_info.symbol, {'target_position': 0.0})
-                    old_position = current_pos['target_position']
-                    
-                    # 判断是否需要调整
-                    if abs(target_position - old_position) > 0.001:  # 容忍0.1%的差异
-                        self.execute_position_adjustment(symbol_info, target_position, "尾盘同步")
-                    else:
-                        direction = "多头" if target_position > 0 else ("空头" if target_position < 0 else "空仓")
-                        logger.info(f"{symbol_info.symbol}: 仓位一致，无需调整 ({direction}{abs(target_position)*100:.1f}%)")
-                else:
-                    logger.warning(f"无法获取 {symbol_info.symbol} 的实时预测")
-                
-               # time.sleep(0.1)
-                
-            except Exception as e:
-                logger.error(f"处理 {symbol_info.symbol} 尾盘检查时出错: {e}")
+        """尾盘检查并同步（使用实时预测）"""
+        self._check_and_sync(self.get_realtime_position, "尾盘", "实时预测")
     
     def run(self):
         """运行策略主循环"""
@@ -1066,18 +1544,24 @@ class MultiMarketTrader:
         logger.info("尾盘: 14:30, 14:45")
         logger.info("汇总: 15:05")
         
-        # 主循环
+        # 主循环；出错后按指数退避重试（1秒起，最长60秒，加随机抖动），成功后复位
+        backoff = 1
         while True:
             try:
                 schedule.run_pending()
-               # time.sleep(0.1)
+                backoff = 1
+                # 休眠到下一个定时任务，最长60秒；临近触发时至少休眠0.1秒
+                idle = schedule.idle_seconds()
+                time.sleep(max(0.1, min(idle if idle is not None else 60, 60)))
                 
             except KeyboardInterrupt:
                 logger.info("\n收到中断信号，停止运行")
+                self.close()
                 break
             except Exception as e:
                 logger.error(f"主循环错误: {e}")
-                time.sleep(60)
+                time.sleep(backoff + random.random())
+                backoff = min(60, backoff * 2)
 
 
 # 使用示例
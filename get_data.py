@@ -1,27 +1,170 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 import json
-from typing import Optional, Dict, Any
+import logging
+import os
+import hashlib
+from typing import Optional, Dict, Any, List
 import time
-from datetime import datetime, timedelta
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson  # 可选依赖：更快的JSON编解码
+except ImportError:
+    orjson = None
+
+
+def _dumps(obj) -> bytes:
+    """序列化请求体为UTF-8字节，优先使用orjson；requests直接发送bytes，无需再编码"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(content: bytes):
+    """解析响应体，优先使用orjson"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class UQToolError(Exception):
+    """UQTool客户端错误基类"""
+
+
+class UQToolNetworkError(UQToolError):
+    """网络请求失败或响应无法解析为JSON"""
+
+
+class UQToolAPIError(UQToolError):
+    """接口返回 success=False"""
+
 
 class UQToolAPI:
     """UQTool API 客户端"""
     
-    def __init__(self, api_key: str):
+    # 已知接口，初始化时预先拼接完整URL
+    ENDPOINTS = ('visitors-data/', 'predict/', 'history/')
+    # 响应缓存（预测、人气指数、基础信息共用）的最大条目数
+    CACHE_SIZE = 4096
+    # POST请求的固定请求头（API密钥已设置在session上）
+    JSON_HEADERS = {'Content-Type': 'application/json'}
+    # 历史数据中的数值列，接口可能以字符串返回，构造DataFrame后统一转换为数值类型
+    HISTORY_NUMERIC_COLUMNS = ('open', 'high', 'low', 'close', 'pre_close', 'change',
+                               'pct_chg', 'vol', 'amount', 'position')
+    
+    def __init__(self, api_key: str, max_requests_per_second: float = 15.0,
+                 cache_dir: Optional[str] = None, raise_errors: bool = False,
+                 warm_up: bool = True):
+        """
+        Args:
+            api_key: UQTool API密钥
+            max_requests_per_second: 请求频率上限，并发调用时按此间隔排队发出，
+                                     0表示不限制；429响应由连接池按Retry-After退避重试
+            cache_dir: 历史数据磁盘缓存目录（如 ~/.uqtool_cache），None表示不启用；
+                       只缓存结束日期早于昨天、且结果非空的窗口，这类数据不会再变化
+            raise_errors: 为True时失败抛出UQToolError子类异常，
+                          否则记录日志并返回None
+            warm_up: 为True时初始化时预先建立一个连接，False则不在构造时发起网络请求
+        """
         self.api_key = api_key
+        self.raise_errors = raise_errors
         self.base_url = "https://www.uqtool.com/wp-json/swtool/v1"
+        self._urls = {endpoint: f"{self.base_url}/{endpoint}" for endpoint in self.ENDPOINTS}
         self.session = requests.Session()
+        # 复用连接池，避免每次请求重新进行TCP/TLS握手；
+        # 瞬时错误在连接池内指数退避重试，复用已建立的连接
+        retry = Retry(total=3, backoff_factor=0.1,
+                      status_forcelist=(429, 502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'POST']))
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # API密钥通过header统一传递，无需每次请求构造headers；
+        # requests默认已发送 Accept-Encoding: gzip, deflate 并自动解压
+        self.session.headers.update({'X-API-KEY': api_key, 'Accept': 'application/json'})
+        # 响应缓存 {(接口, 参数...): (写入时间, 结果)}，按LRU淘汰
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 请求限流：下一个请求最早可发出的时间
+        self._min_interval = 1.0 / max_requests_per_second if max_requests_per_second > 0 else 0.0
+        self._next_request_at = 0.0
+        self._throttle_lock = threading.Lock()
+        # 各接口请求参数中的固定部分，调用时复制后补充可变参数
+        self._history_params = {'api_key': api_key, 'table_type': 'market'}
+        self._basic_params = {'api_key': api_key, 'table_type': 'basic'}
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        if warm_up:
+            self.warm_up_connection()
+    
+    def warm_up_connection(self):
+        """预先建立一个连接（DNS+TCP+TLS），首个请求直接复用连接池中的连接"""
+        # 预热只尝试一次：临时关闭连接池的重试，主机不可达时最多等待一个timeout
+        adapter = self.session.get_adapter(self.base_url)
+        max_retries = adapter.max_retries
+        adapter.max_retries = Retry(0, read=False)
+        try:
+            self.session.head(self.base_url, timeout=3, allow_redirects=False)
+        except requests.exceptions.RequestException as e:
+            logger.debug("预热连接失败: %s", e)
+        finally:
+            adapter.max_retries = max_retries
+    
+    def _cache_get(self, key: tuple, ttl: float):
+        """读取未过期的缓存结果，不存在或已过期返回None"""
+        if ttl <= 0:
+            return None
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached and time.monotonic() - cached[0] < ttl:
+                self._cache.move_to_end(key)
+                return cached[1]
+        return None
+    
+    def _cache_put(self, key: tuple, value):
+        """写入缓存，超出CACHE_SIZE时淘汰最久未使用的条目"""
+        with self._cache_lock:
+            self._cache[key] = (time.monotonic(), value)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+    
+    def _disk_cache_path(self, params: Dict) -> str:
+        """按请求参数（不含API密钥）计算磁盘缓存文件路径"""
+        key_params = sorted((k, v) for k, v in params.items() if k != 'api_key')
+        digest = hashlib.blake2b(_dumps(key_params), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, f"history_{digest}.json")
+    
+    def _throttle(self):
+        """按最小请求间隔排队，超出频率上限时等待"""
+        if not self._min_interval:
+            return
+        with self._throttle_lock:
+            now = time.monotonic()
+            wait = self._next_request_at - now
+            self._next_request_at = max(now, self._next_request_at) + self._min_interval
+        if wait > 0:
+            time.sleep(wait)
         
     def _make_request(self, endpoint: str, method='GET', **kwargs):
         """发送请求的通用方法"""
-        url = f"{self.base_url}/{endpoint}"
+        url = self._urls.get(endpoint) or f"{self.base_url}/{endpoint}"
         
         try:
             # 添加调试信息
-            print(f"请求URL: {url}")
-            print(f"请求方法: {method}")
+            logger.debug("请求URL: %s", url)
+            logger.debug("请求方法: %s", method)
             
+            self._throttle()
             if method.upper() == 'GET':
                 response = self.session.get(url, **kwargs)
             elif method.upper() == 'POST':
@@ -30,126 +173,255 @@ class UQToolAPI:
                 raise ValueError(f"不支持的请求方法: {method}")
             
             # 打印响应状态码
-            print(f"响应状态码: {response.status_code}")
+            logger.debug("响应状态码: %s", response.status_code)
             
             response.raise_for_status()
             
             # 尝试解析JSON
             try:
-                result = response.json()
-                print(f"JSON响应: {json.dumps(result, ensure_ascii=False, indent=2)}")
+                result = _loads(response.content)
+                logger.debug("JSON响应: %s", result)
                 return result
-            except json.JSONDecodeError:
-                print(f"响应内容（非JSON）: {response.text[:200]}")
+            except json.JSONDecodeError as e:
+                if self.raise_errors:
+                    raise UQToolNetworkError(f"响应内容不是JSON: {url}") from e
+                logger.warning("响应内容（非JSON）: %s", response.text[:200])
                 return None
                 
         except requests.exceptions.RequestException as e:
-            print(f"请求错误: {e}")
+            if self.raise_errors:
+                raise UQToolNetworkError(str(e)) from e
+            logger.error("请求错误: %s", e)
             if hasattr(e, 'response') and e.response is not None:
-                print(f"错误响应: {e.response.text[:500]}")
+                logger.error("错误响应: %s", e.response.text[:500])
+            return None
+    
+    def _api_error(self, label: str, data: Optional[Dict]):
+        """处理接口返回的错误（success不为True或响应为空）：抛出UQToolAPIError或记录日志"""
+        if data is None and not self.raise_errors:
+            return  # 请求失败，_make_request已记录错误
+        if not data:
+            if self.raise_errors:
+                raise UQToolAPIError(f"{label}API返回空响应")
+            logger.error("%sAPI返回空响应", label)
+            return
+        message = data.get('message', '未知错误')
+        if self.raise_errors:
+            raise UQToolAPIError(f"{label}API返回错误: {message}")
+        logger.error("%sAPI返回错误: %s", label, message)
+    
+    def _call_or_none(self, fn, *args, **kwargs):
+        """批量接口中的单项调用：raise_errors模式下的异常也记为None，不影响其他项"""
+        try:
+            return fn(*args, **kwargs)
+        except UQToolError as e:
+            logger.error("批量请求单项失败: %s", e)
             return None
     
-    def get_popularity(self, days: int = 7) -> Optional[pd.DataFrame]:
-        """获取人气指数"""
+    def get_popularity(self, days: int = 7, cache_ttl: float = 3600.0) -> Optional[pd.DataFrame]:
+        """
+        获取人气指数
+        
+        Args:
+            cache_ttl: 相同days查询的缓存秒数，0表示不使用缓存
+        """
+        cache_key = ('popularity', days)
+        cached = self._cache_get(cache_key, cache_ttl)
+        if cached is not None:
+            return cached.copy()
+        
         params = {
             'days': days,
             'time_unit': 'day',
             'api_key': self.api_key
         }
-        print(f"人气指数请求参数: {params}")
+        logger.debug("人气指数请求参数: %s", params)
         
         data = self._make_request("visitors-data/", params=params)
         
         if data and data.get('success') == True:  # 注意：使用success字段
-            return pd.DataFrame(data['data'])
-        elif data:
-            print(f"人气指数API返回错误: {data.get('message', '未知错误')}")
+            df = pd.DataFrame(data['data'])
+            if cache_ttl > 0:
+                self._cache_put(cache_key, df)
+                return df.copy()
+            return df
+        else:
+            self._api_error("人气指数", data)
         return None
     
     def predict(self, market: str, code: str, price: float, 
-                allow_short: int = 0) -> Optional[Dict]:
-        """AI实时预测"""
-        headers = {
-            'Content-Type': 'application/json', 
-            'X-API-KEY': self.api_key
-        }
+                allow_short: int = 0, cache_ttl: float = 1.0) -> Optional[Dict]:
+        """
+        AI实时预测
+        
+        Args:
+            cache_ttl: 相同(market, code, price, allow_short)查询的缓存秒数，
+                       0表示不使用缓存
+        """
+        # 价格序列通常已是字符串；数值用str转换（浮点数为可往返的最短表示，不丢精度），
+        # 缓存键也按字符串精确匹配
+        price_str = price if type(price) is str else str(price)
+        cache_key = ('predict', market, code, price_str, allow_short)
+        cached = self._cache_get(cache_key, cache_ttl)
+        if cached is not None:
+            return dict(cached) if isinstance(cached, dict) else cached
+        
         payload = {
             'market': market,
             'code': code,
-            'price': str(price),
+            'price': price_str,
             'allow_short': allow_short
         }
         
-        print(f"预测请求参数: {payload}")
-        print(f"请求头: {headers}")
+        logger.debug("预测请求参数: %s", payload)
         
         data = self._make_request("predict/", method='POST', 
-                                  headers=headers, data=json.dumps(payload))
+                                  headers=self.JSON_HEADERS, data=_dumps(payload))
         
         if data and data.get('success') == True:
-            return data['data']
-        elif data:
-            print(f"预测API返回错误: {data.get('message', '未知错误')}")
+            result = data['data']
+            if cache_ttl > 0:
+                self._cache_put(cache_key, result)
+                return dict(result) if isinstance(result, dict) else result
+            return result
+        else:
+            self._api_error("预测", data)
         return None
     
+    def predict_batch(self, items: List[Dict], max_workers: int = 16) -> List[Optional[Dict]]:
+        """
+        并发批量AI实时预测
+        
+        Args:
+            items: 预测参数列表，每项为predict的关键字参数，如
+                   {'market': 'cnstock', 'code': '000001.SZ', 'price': 11.5}
+            max_workers: 并发线程数，过大可能触发服务端限流
+            
+        Returns:
+            与items顺序一致的预测结果列表，失败项为None（raise_errors模式下同样不抛出）
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda item: self._call_or_none(self.predict, **item), items))
+    
     def get_history(self, market: str, ts_code: str, 
                     start_date: str = None, end_date: str = None,
                     max_items: int = 10000) -> Optional[pd.DataFrame]:
         """获取历史数据 - 使用正确的端点 /history/"""
-        params = {
-            'api_key': self.api_key,
-            'market': market,
-            'ts_code': ts_code,
-            'table_type': 'market',
-            'max_items': max_items  # 添加max_items参数
-        }
+        params = self._history_params.copy()
+        params['market'] = market
+        params['ts_code'] = ts_code
+        params['max_items'] = max_items
         
         if start_date:
             params['start_date'] = start_date
         if end_date:
             params['end_date'] = end_date
-            
-        # 同时通过header传递API密钥（双重认证）
-        headers = {'X-API-KEY': self.api_key}
         
-        print(f"历史数据请求参数: {params}")
-        print(f"请求头: {headers}")
+        # 结束日期已过去一整天以上的窗口数据不可变，可从磁盘缓存读取；
+        # 留出一天余量，避免服务端尚未发布最终数据或本地时区领先于市场时缓存不完整的结果
+        cache_path = None
+        if (self.cache_dir and end_date
+                and end_date < (date.today() - timedelta(days=1)).isoformat()):
+            cache_path = self._disk_cache_path(params)
+            try:
+                with open(cache_path, 'rb') as f:
+                    return self._history_frame(_loads(f.read()))
+            except (OSError, ValueError):
+                pass
+        
+        # API密钥同时通过session的header传递（双重认证）
+        logger.debug("历史数据请求参数: %s", params)
         
-        data = self._make_request("history/", params=params, headers=headers)
+        data = self._make_request("history/", params=params)
         
         if data and data.get('success') == True:
-            return pd.DataFrame(data['data'])
-        elif data:
-            print(f"历史数据API返回错误: {data.get('message', '未知错误')}")
+            # 空结果可能是代码错误或数据尚未发布，不写入缓存
+            if cache_path and data['data']:
+                try:
+                    tmp_path = f"{cache_path}.tmp"
+                    with open(tmp_path, 'wb') as f:
+                        f.write(_dumps(data['data']))
+                    os.replace(tmp_path, cache_path)
+                except OSError as e:
+                    logger.warning("写入历史数据缓存失败: %s", e)
+            return self._history_frame(data['data'])
+        else:
+            self._api_error("历史数据", data)
         return None
     
-    def get_basic_info(self, market: str, ts_code: str) -> Optional[Dict]:
-        """获取基础信息 - 应该使用 /history/ 端点，但table_type='basic'"""
-        params = {
-            'api_key': self.api_key,
-            'market': market,
-            'ts_code': ts_code,
-            'table_type': 'basic'
-        }
+    def get_history_batch(self, market: str, ts_codes: List[str],
+                          start_date: str = None, end_date: str = None,
+                          max_items: int = 10000,
+                          max_workers: int = 8) -> Dict[str, Optional[pd.DataFrame]]:
+        """
+        并发批量获取多个代码的历史数据，共享session连接池
         
-        headers = {'X-API-KEY': self.api_key}
+        Args:
+            ts_codes: 代码列表
+            max_workers: 并发线程数，过大可能触发服务端限流
+            
+        Returns:
+            {ts_code: DataFrame}，失败项为None（raise_errors模式下同样不抛出）
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = executor.map(
+                lambda ts_code: self._call_or_none(self.get_history, market, ts_code,
+                                                   start_date, end_date, max_items),
+                ts_codes)
+            return dict(zip(ts_codes, frames))
+    
+    def _history_frame(self, records: List[Dict]) -> pd.DataFrame:
+        """将历史数据记录构造为DataFrame，并把数值列转换为数值类型"""
+        df = pd.DataFrame.from_records(records)
+        # pandas 3 中字符串列为str类型而非object，按"非数值类型"判断
+        numeric_columns = [c for c in self.HISTORY_NUMERIC_COLUMNS
+                           if c in df.columns and not pd.api.types.is_numeric_dtype(df[c])]
+        if numeric_columns:
+            df[numeric_columns] = df[numeric_columns].apply(pd.to_numeric, errors='coerce')
+        return df
+    
+    def get_basic_info(self, market: str, ts_code: str,
+                       cache_ttl: float = 86400.0) -> Optional[Dict]:
+        """
+        获取基础信息 - 应该使用 /history/ 端点，但table_type='basic'
+        
+        Args:
+            cache_ttl: 相同(market, ts_code)查询的缓存秒数，0表示不使用缓存
+        """
+        cache_key = ('basic_info', market, ts_code)
+        cached = self._cache_get(cache_key, cache_ttl)
+        if cached is not None:
+            return dict(cached) if isinstance(cached, dict) else cached
         
-        print(f"基础信息请求参数: {params}")
+        params = self._basic_params.copy()
+        params['market'] = market
+        params['ts_code'] = ts_code
         
-        data = self._make_request("history/", params=params, headers=headers)
+        logger.debug("基础信息请求参数: %s", params)
+        
+        data = self._make_request("history/", params=params)
         
         if data and data.get('success') == True:
             # 基础信息可能直接返回数据，而不是数组
             if isinstance(data['data'], list) and len(data['data']) > 0:
-                return data['data'][0]  # 返回第一条记录
-            return data['data']
-        elif data:
-            print(f"基础信息API返回错误: {data.get('message', '未知错误')}")
+                info = data['data'][0]  # 返回第一条记录
+            else:
+                info = data['data']
+            if cache_ttl > 0 and info:
+                self._cache_put(cache_key, info)
+                return dict(info) if isinstance(info, dict) else info
+            return info
+        else:
+            self._api_error("基础信息", data)
         return None
 
 
 # 综合使用示例
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
     try:
         # 初始化客户端
         api_key = "YOU-API-KEY"
@@ -184,11 +456,12 @@ if __name__ == "__main__":
         
         # 3. 获取历史数据 - 使用股票数据测试
         print("\n=== 获取历史数据（股票） ===")
+        today = datetime.now()
         history = client.get_history(
             market="cnstock",  
             ts_code="000001.SZ",
-            start_date=(datetime.now() - timedelta(days=5)).strftime('%Y-%m-%d'),  # 使用最近的日期
-            end_date=(datetime.now()).strftime('%Y-%m-%d'),
+            start_date=(today - timedelta(days=5)).strftime('%Y-%m-%d'),  # 使用最近的日期
+            end_date=today.strftime('%Y-%m-%d'),
             max_items=1000
         )
         if history is not None: